@@ -48,6 +48,19 @@ class Appointment(BaseModel):
     class Config:
         populate_by_name = True
 
+class UserAppointmentOut(BaseModel):
+    id: str = Field(alias="_id")
+    doctor_name: str
+    doctor_specialty: str
+    date: str
+    time_slot: str
+    status: str
+    created_at: datetime
+    updated_at: datetime
+    
+    class Config:
+        populate_by_name = True
+
 # Doctor Model (for reference)
 class Doctor(BaseModel):
     id: str = Field(alias="_id")
@@ -1,54 +1,55 @@
 from fastapi import APIRouter, HTTPException, Depends, status
-from datetime import datetime, date
+from datetime import datetime, date, timezone
+from calendar import monthrange
 from bson import ObjectId
+from pymongo.errors import DuplicateKeyError
 from typing import List
 
-from app.models import AppointmentCreate, AppointmentUpdate, AppointmentResponse, Appointment, Doctor
-from app.database import appointments_collection, doctors_collection, serialize_doc
+from app.models import AppointmentCreate, AppointmentUpdate, AppointmentResponse, Appointment, UserAppointmentOut, Doctor
+from app.database import appointments_collection, doctors_collection, serialize_doc, get_doctor_cached
 from app.auth import get_current_user
 
 router = APIRouter(prefix="/api/v1/appointments", tags=["Appointments"])
 
+def _is_ascii_digits(value: str) -> bool:
+    return value.isascii() and value.isdigit()
+
 def validate_date_format(date_str: str) -> bool:
     """Validate date format YYYY-MM-DD"""
-    try:
-        datetime.strptime(date_str, "%Y-%m-%d")
-        return True
-    except ValueError:
+    if len(date_str) != 10 or date_str[4] != '-' or date_str[7] != '-':
+        return False
+    year, month, day = date_str[0:4], date_str[5:7], date_str[8:10]
+    if not _is_ascii_digits(year + month + day):
+        return False
+    year, month, day = int(year), int(month), int(day)
+    if year < 1 or not 1 <= month <= 12:
+        return False
+    return 1 <= day <= monthrange(year, month)[1]
+
+def _is_valid_time(time_str: str) -> bool:
+    """Validate time format HH:MM"""
+    if len(time_str) != 5 or time_str[2] != ':':
+        return False
+    hours, minutes = time_str[0:2], time_str[3:5]
+    if not _is_ascii_digits(hours + minutes):
         return False
+    return int(hours) <= 23 and int(minutes) <= 59
 
 def validate_time_slot_format(time_slot: str) -> bool:
     """Validate time slot format HH:MM-HH:MM"""
-    try:
-        start_time, end_time = time_slot.split('-')
-        datetime.strptime(start_time, "%H:%M")
-        datetime.strptime(end_time, "%H:%M")
-        return True
-    except ValueError:
+    if len(time_slot) != 11 or time_slot[5] != '-':
         return False
+    return _is_valid_time(time_slot[0:5]) and _is_valid_time(time_slot[6:11])
 
 def is_appointment_date_future(date_str: str) -> bool:
-    """Check if appointment date is in the future"""
-    appointment_date = datetime.strptime(date_str, "%Y-%m-%d").date()
+    """Check if appointment date is in the future (expects a validated date)"""
+    appointment_date = date(int(date_str[0:4]), int(date_str[5:7]), int(date_str[8:10]))
     return appointment_date >= date.today()
 
-def is_slot_available(doctor_id: str, appointment_date: str, time_slot: str) -> bool:
-    """Check if time slot is available for the doctor on given date"""
-    
-    # Check if doctor exists and has this time slot
-    doctor = doctors_collection.find_one({"_id": ObjectId(doctor_id)})
-    if not doctor or time_slot not in doctor["available_slots"]:
-        return False
-    
-    # Check if slot is already booked
-    existing_appointment = appointments_collection.find_one({
-        "doctor_id": ObjectId(doctor_id),
-        "date": appointment_date,
-        "time_slot": time_slot,
-        "status": {"$ne": "cancelled"}
-    })
-    
-    return existing_appointment is None
+async def doctor_has_time_slot(doctor_id: ObjectId, time_slot: str) -> bool:
+    """Check if doctor exists and offers the given time slot"""
+    doctor = await get_doctor_cached(doctor_id)
+    return doctor is not None and time_slot in doctor["available_slots"]
 
 @router.post("/", response_model=AppointmentResponse)
 async def create_appointment(
@@ -79,34 +80,40 @@ async def create_appointment(
         )
     
     # Validate doctor_id format
-    try:
-        doctor_object_id = ObjectId(appointment_data.doctor_id)
-    except:
+    if not ObjectId.is_valid(appointment_data.doctor_id):
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail="Invalid doctor ID format"
         )
+    doctor_object_id = ObjectId(appointment_data.doctor_id)
     
-    # Check if slot is available
-    if not is_slot_available(appointment_data.doctor_id, appointment_data.date, appointment_data.time_slot):
+    # Check if doctor offers this slot (double booking is enforced by a unique index)
+    if not await doctor_has_time_slot(doctor_object_id, appointment_data.time_slot):
         raise HTTPException(
             status_code=status.HTTP_409_CONFLICT,
             detail="Time slot is not available or doctor not found"
         )
     
     # Create appointment document
+    now = datetime.now(timezone.utc)
     appointment_doc = {
         "user_id": ObjectId(current_user_id),
         "doctor_id": doctor_object_id,
         "date": appointment_data.date,
         "time_slot": appointment_data.time_slot,
         "status": "booked",
-        "created_at": datetime.utcnow(),
-        "updated_at": datetime.utcnow()
+        "created_at": now,
+        "updated_at": now
     }
     
     # Insert appointment
-    result = appointments_collection.insert_one(appointment_doc)
+    try:
+        result = await appointments_collection.insert_one(appointment_doc)
+    except DuplicateKeyError:
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail="Time slot is not available or doctor not found"
+        )
     
     return AppointmentResponse(
         success=True,
@@ -114,22 +121,37 @@ async def create_appointment(
         appointment_id=str(result.inserted_id)
     )
 
-@router.get("/", response_model=List[dict])
+@router.get("/", response_model=List[UserAppointmentOut])
 async def get_user_appointments(current_user_id: str = Depends(get_current_user)):
     """Get all appointments for the current user"""
     
     # Create aggregation pipeline to join with doctors collection
     pipeline = [
         {"$match": {"user_id": ObjectId(current_user_id)}},
+        {"$sort": {"date": 1, "time_slot": 1}},
+        # Carry only the fields needed downstream into the join
+        {
+            "$project": {
+                "doctor_id": 1,
+                "date": 1,
+                "time_slot": 1,
+                "status": 1,
+                "created_at": 1,
+                "updated_at": 1
+            }
+        },
         {
             "$lookup": {
                 "from": "doctors",
-                "localField": "doctor_id",
-                "foreignField": "_id",
+                "let": {"did": "$doctor_id"},
+                "pipeline": [
+                    {"$match": {"$expr": {"$eq": ["$_id", "$$did"]}}},
+                    {"$project": {"_id": 0, "name": 1, "specialty": 1}}
+                ],
                 "as": "doctor_info"
             }
         },
-        {"$unwind": "$doctor_info"},
+        {"$unwind": {"path": "$doctor_info", "preserveNullAndEmptyArrays": False}},
         {
             "$project": {
                 "_id": {"$toString": "$_id"},
@@ -141,13 +163,30 @@ async def get_user_appointments(current_user_id: str = Depends(get_current_user)
                 "created_at": 1,
                 "updated_at": 1
             }
-        },
-        {"$sort": {"date": 1, "time_slot": 1}}
+        }
     ]
     
-    appointments = list(appointments_collection.aggregate(pipeline))
+    appointments = await appointments_collection.aggregate(pipeline).to_list(None)
     return appointments
 
+async def appointment_not_modified_error(appointment_object_id: ObjectId, user_object_id: ObjectId, cancelled_detail: str) -> HTTPException:
+    """Build the error for a conditional update that matched no appointment"""
+    appointment = await appointments_collection.find_one(
+        {"_id": appointment_object_id, "user_id": user_object_id},
+        {"status": 1}
+    )
+    
+    if not appointment:
+        return HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Appointment not found"
+        )
+    
+    return HTTPException(
+        status_code=status.HTTP_400_BAD_REQUEST,
+        detail=cancelled_detail
+    )
+
 @router.put("/{appointment_id}", response_model=AppointmentResponse)
 async def update_appointment(
     appointment_id: str,
@@ -157,34 +196,24 @@ async def update_appointment(
     """Reschedule an existing appointment"""
     
     # Validate appointment_id format
-    try:
-        appointment_object_id = ObjectId(appointment_id)
-    except:
+    if not ObjectId.is_valid(appointment_id):
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail="Invalid appointment ID format"
         )
+    appointment_object_id = ObjectId(appointment_id)
+    user_object_id = ObjectId(current_user_id)
+    cancelled_detail = "Cannot update cancelled appointment"
     
-    # Find appointment
-    appointment = appointments_collection.find_one({
+    # Only the owner's non-cancelled appointment may be updated
+    appointment_filter = {
         "_id": appointment_object_id,
-        "user_id": ObjectId(current_user_id)
-    })
-    
-    if not appointment:
-        raise HTTPException(
-            status_code=status.HTTP_404_NOT_FOUND,
-            detail="Appointment not found"
-        )
-    
-    # Check if appointment is not cancelled
-    if appointment["status"] == "cancelled":
-        raise HTTPException(
-            status_code=status.HTTP_400_BAD_REQUEST,
-            detail="Cannot update cancelled appointment"
-        )
+        "user_id": user_object_id,
+        "status": {"$ne": "cancelled"}
+    }
     
-    # Prepare update data
+    # Prepare update data. The body is validated before the appointment is
+    # looked up, so body errors (400) take precedence over 404/cancelled.
     update_fields = {}
     
     if update_data.date:
@@ -207,9 +236,13 @@ async def update_appointment(
                 detail="Invalid time slot format. Use HH:MM-HH:MM"
             )
         
-        # Check if new time slot is available
-        new_date = update_data.date if update_data.date else appointment["date"]
-        if not is_slot_available(str(appointment["doctor_id"]), new_date, update_data.time_slot):
+        # Find appointment to learn which doctor the slot belongs to
+        appointment = await appointments_collection.find_one(appointment_filter, {"doctor_id": 1})
+        if not appointment:
+            raise await appointment_not_modified_error(appointment_object_id, user_object_id, cancelled_detail)
+        
+        # Check if doctor offers the new time slot
+        if not await doctor_has_time_slot(appointment["doctor_id"], update_data.time_slot):
             raise HTTPException(
                 status_code=status.HTTP_409_CONFLICT,
                 detail="New time slot is not available"
@@ -223,13 +256,22 @@ async def update_appointment(
         )
     
     # Add updated_at timestamp
-    update_fields["updated_at"] = datetime.utcnow()
+    update_fields["updated_at"] = datetime.now(timezone.utc)
     
-    # Update appointment
-    appointments_collection.update_one(
-        {"_id": appointment_object_id},
-        {"$set": update_fields}
-    )
+    # Update appointment atomically (the unique slot index rejects double booking)
+    try:
+        result = await appointments_collection.update_one(
+            appointment_filter,
+            {"$set": update_fields}
+        )
+    except DuplicateKeyError:
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail="New time slot is not available"
+        )
+    
+    if result.matched_count == 0:
+        raise await appointment_not_modified_error(appointment_object_id, user_object_id, cancelled_detail)
     
     return AppointmentResponse(
         success=True,
@@ -245,44 +287,34 @@ async def cancel_appointment(
     """Cancel an appointment"""
     
     # Validate appointment_id format
-    try:
-        appointment_object_id = ObjectId(appointment_id)
-    except:
+    if not ObjectId.is_valid(appointment_id):
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail="Invalid appointment ID format"
         )
+    appointment_object_id = ObjectId(appointment_id)
+    user_object_id = ObjectId(current_user_id)
     
-    # Find appointment
-    appointment = appointments_collection.find_one({
-        "_id": appointment_object_id,
-        "user_id": ObjectId(current_user_id)
-    })
-    
-    if not appointment:
-        raise HTTPException(
-            status_code=status.HTTP_404_NOT_FOUND,
-            detail="Appointment not found"
-        )
-    
-    # Check if appointment is already cancelled
-    if appointment["status"] == "cancelled":
-        raise HTTPException(
-            status_code=status.HTTP_400_BAD_REQUEST,
-            detail="Appointment is already cancelled"
-        )
-    
-    # Update appointment status to cancelled
-    appointments_collection.update_one(
-        {"_id": appointment_object_id},
+    # Cancel the owner's appointment unless it is already cancelled
+    result = await appointments_collection.update_one(
+        {
+            "_id": appointment_object_id,
+            "user_id": user_object_id,
+            "status": {"$ne": "cancelled"}
+        },
         {
             "$set": {
                 "status": "cancelled",
-                "updated_at": datetime.utcnow()
+                "updated_at": datetime.now(timezone.utc)
             }
         }
     )
     
+    if result.matched_count == 0:
+        raise await appointment_not_modified_error(
+            appointment_object_id, user_object_id, "Appointment is already cancelled"
+        )
+    
     return AppointmentResponse(
         success=True,
         message="Appointment cancelled successfully.",
@@ -293,5 +325,5 @@ async def cancel_appointment(
 @router.get("/doctors", response_model=List[Doctor])
 async def get_doctors():
     """Get list of all doctors"""
-    doctors = list(doctors_collection.find())
+    doctors = await doctors_collection.find().to_list(None)
     return [serialize_doc(doctor) for doctor in doctors]
\ No newline at end of file
@@ -1,10 +1,18 @@
 from fastapi import APIRouter, HTTPException, Depends, status
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
-from jose import JWTError, jwt
-from bcrypt import hashpw, gensalt, checkpw
-from datetime import datetime, timedelta
+from jwt import InvalidTokenError
+import jwt
+from argon2 import PasswordHasher
+from argon2.exceptions import InvalidHashError, VerificationError
+from bcrypt import checkpw
+from datetime import datetime, timedelta, timezone
+from functools import lru_cache
 from bson import ObjectId
+from pymongo.errors import DuplicateKeyError
+import asyncio
+import os
 import re
+import time
 
 from app.models import UserSignUp, UserSignIn, UserResponse, TokenResponse
 from app.database import users_collection
@@ -16,40 +24,66 @@ SECRET_KEY = "your-secret-key-change-in-production"
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 30
 
+# Password hashing settings (argon2id; bcrypt hashes are still accepted)
+password_hasher = PasswordHasher(
+    time_cost=int(os.environ.get("ARGON2_TIME_COST", "2")),
+    memory_cost=int(os.environ.get("ARGON2_MEMORY_COST", "19456")),
+    parallelism=1
+)
+BCRYPT_PREFIXES = ("$2a$", "$2b$", "$2y$")
+
 security = HTTPBearer()
 
+EMAIL_PATTERN = re.compile(r'^[a-zA-Z0-9._%+-]+@[a-zA-Z0-9.-]+\.[a-zA-Z]{2,}$')
+
 def validate_email(email: str) -> bool:
     """Validate email format"""
-    pattern = r'^[a-zA-Z0-9._%+-]+@[a-zA-Z0-9.-]+\.[a-zA-Z]{2,}$'
-    return re.match(pattern, email) is not None
+    return EMAIL_PATTERN.match(email) is not None
 
 def hash_password(password: str) -> str:
-    """Hash password using bcrypt"""
-    return hashpw(password.encode('utf-8'), gensalt()).decode('utf-8')
+    """Hash password using argon2id"""
+    return password_hasher.hash(password)
 
 def verify_password(plain_password: str, hashed_password: str) -> bool:
-    """Verify password against hash"""
-    return checkpw(plain_password.encode('utf-8'), hashed_password.encode('utf-8'))
+    """Verify password against hash (argon2id, or legacy bcrypt)"""
+    if hashed_password.startswith(BCRYPT_PREFIXES):
+        return checkpw(plain_password.encode('utf-8'), hashed_password.encode('utf-8'))
+    try:
+        return password_hasher.verify(hashed_password, plain_password)
+    except (VerificationError, InvalidHashError):
+        return False
+
+def password_needs_rehash(hashed_password: str) -> bool:
+    """Check if hash is legacy bcrypt or uses outdated argon2 parameters"""
+    if hashed_password.startswith(BCRYPT_PREFIXES):
+        return True
+    return password_hasher.check_needs_rehash(hashed_password)
 
 def create_access_token(data: dict):
     """Create JWT access token"""
     to_encode = data.copy()
-    expire = datetime.utcnow() + timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
+    expire = datetime.now(timezone.utc) + timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
     to_encode.update({"exp": expire})
     return jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
 
+@lru_cache(maxsize=8192)
+def decode_access_token(token: str) -> tuple:
+    """Verify JWT signature once per token and return (sub, exp)"""
+    payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+    return payload.get("sub"), payload.get("exp")
+
 def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(security)):
     """Get current user from JWT token"""
     try:
-        payload = jwt.decode(credentials.credentials, SECRET_KEY, algorithms=[ALGORITHM])
-        user_id: str = payload.get("sub")
-        if user_id is None:
+        user_id, expires_at = decode_access_token(credentials.credentials)
+        # Cached tokens must still be rejected once they expire
+        if user_id is None or (expires_at is not None and expires_at <= time.time()):
             raise HTTPException(
                 status_code=status.HTTP_401_UNAUTHORIZED,
                 detail="Invalid authentication credentials"
             )
         return user_id
-    except JWTError:
+    except InvalidTokenError:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Invalid authentication credentials"
@@ -66,25 +100,24 @@ async def sign_up(user_data: UserSignUp):
             detail="Invalid email format"
         )
     
-    # Check if user already exists
-    if users_collection.find_one({"email": user_data.email}):
-        raise HTTPException(
-            status_code=status.HTTP_400_BAD_REQUEST,
-            detail="Email already registered"
-        )
-    
-    # Hash password
-    hashed_password = hash_password(user_data.password)
+    # Hash password off the event loop (hashing is CPU-bound)
+    hashed_password = await asyncio.to_thread(hash_password, user_data.password)
     
     # Create user document
     user_doc = {
         "email": user_data.email,
         "hashed_password": hashed_password,
-        "created_at": datetime.utcnow()
+        "created_at": datetime.now(timezone.utc)
     }
     
-    # Insert user into database
-    result = users_collection.insert_one(user_doc)
+    # Insert user into database (the unique email index rejects duplicates)
+    try:
+        result = await users_collection.insert_one(user_doc)
+    except DuplicateKeyError:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Email already registered"
+        )
     
     return UserResponse(
         success=True,
@@ -97,20 +130,28 @@ async def sign_in(user_data: UserSignIn):
     """Authenticate user and return JWT token"""
     
     # Find user by email
-    user = users_collection.find_one({"email": user_data.email})
+    user = await users_collection.find_one({"email": user_data.email})
     if not user:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Invalid email or password"
         )
     
-    # Verify password
-    if not verify_password(user_data.password, user["hashed_password"]):
+    # Verify password off the event loop (hashing is CPU-bound)
+    if not await asyncio.to_thread(verify_password, user_data.password, user["hashed_password"]):
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Invalid email or password"
         )
     
+    # Upgrade legacy or outdated hashes now that we have the plain password
+    if password_needs_rehash(user["hashed_password"]):
+        new_hash = await asyncio.to_thread(hash_password, user_data.password)
+        await users_collection.update_one(
+            {"_id": user["_id"]},
+            {"$set": {"hashed_password": new_hash}}
+        )
+    
     # Create access token
     access_token = create_access_token(data={"sub": str(user["_id"])})
     
@@ -1,9 +1,20 @@
-from pymongo import MongoClient
+from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError, DuplicateKeyError
 from bson import ObjectId
+from typing import Optional
+import asyncio
 import os
+import time
 
 # MongoDB connection
-client = MongoClient("mongodb://localhost:27017/")
+client = AsyncIOMotorClient(
+    "mongodb://localhost:27017/",
+    compressors="zstd,zlib",  # first one supported by both sides wins
+    maxPoolSize=200,
+    minPoolSize=10,
+    serverSelectionTimeoutMS=2000
+)
 db = client["doctor_appointment_db"]
 
 # Collections
@@ -11,6 +22,33 @@ users_collection = db["users"]
 doctors_collection = db["doctors"]
 appointments_collection = db["appointments"]
 
+# In-process cache of doctor documents, keyed by ObjectId
+DOCTOR_CACHE_TTL_SECONDS = 60
+_doctor_cache: dict[ObjectId, tuple[float, dict]] = {}
+
+async def get_doctor_cached(doctor_id: ObjectId):
+    """Return the doctor document (available_slots as a frozenset), served from cache while fresh"""
+    now = time.monotonic()
+    cached = _doctor_cache.get(doctor_id)
+    if cached and cached[0] > now:
+        return cached[1]
+    
+    doctor = await doctors_collection.find_one({"_id": doctor_id})
+    if doctor:
+        # Slots are only used for membership checks
+        doctor["available_slots"] = frozenset(doctor["available_slots"])
+        _doctor_cache[doctor_id] = (now + DOCTOR_CACHE_TTL_SECONDS, doctor)
+    else:
+        _doctor_cache.pop(doctor_id, None)
+    return doctor
+
+def invalidate_doctor_cache(doctor_id: Optional[ObjectId] = None):
+    """Drop one doctor (or all doctors) from the cache"""
+    if doctor_id is None:
+        _doctor_cache.clear()
+    else:
+        _doctor_cache.pop(doctor_id, None)
+
 # Helper function to convert ObjectId to string
 def serialize_doc(doc):
     if doc:
@@ -22,22 +60,52 @@ def serialize_doc(doc):
             doc["doctor_id"] = str(doc["doctor_id"])
     return doc
 
+# Function to create indexes for the hot query shapes (idempotent)
+async def create_unique_index(collection, keys, **kwargs):
+    """Create a unique index, failing startup with a clear error if existing data has duplicates"""
+    try:
+        await collection.create_index(keys, unique=True, **kwargs)
+    except DuplicateKeyError as exc:
+        raise RuntimeError(
+            f"Cannot create unique index {keys!r} on '{collection.name}': existing "
+            f"documents contain duplicates. Remove them and restart."
+        ) from exc
+
+async def ensure_indexes():
+    # One active appointment per doctor slot; cancelled ones free the slot
+    await create_unique_index(
+        appointments_collection,
+        [("doctor_id", 1), ("date", 1), ("time_slot", 1)],
+        partialFilterExpression={"status": "booked"}
+    )
+    # User appointments pipeline: $match on user_id, $sort on date/time_slot
+    await appointments_collection.create_index(
+        [("user_id", 1), ("date", 1), ("time_slot", 1)]
+    )
+    # Sign up / sign in lookups by email
+    await create_unique_index(users_collection, "email")
+    # Sample-doctor seeding upserts by seed_key; keeps concurrent seeders race-free
+    await create_unique_index(doctors_collection, "seed_key", sparse=True)
+
 # Function to create sample doctors (run once)
-def create_sample_doctors():
+async def create_sample_doctors():
     sample_doctors = [
         {
+            "seed_key": "ahmad-mohammadi",
             "name": "Dr. Ahmad Mohammadi",
             "specialty": "Internal Medicine",
             "available_slots": ["09:00-09:30", "09:30-10:00", "10:00-10:30", "11:00-11:30"],
             "created_at": "2025-01-01T00:00:00"
         },
         {
+            "seed_key": "sara-hosseini",
             "name": "Dr. Sara Hosseini",
             "specialty": "Cardiology",
             "available_slots": ["14:00-14:30", "14:30-15:00", "15:00-15:30", "16:00-16:30"],
             "created_at": "2025-01-01T00:00:00"
         },
         {
+            "seed_key": "reza-karimi",
             "name": "Dr. Reza Karimi",
             "specialty": "Neurology",
             "available_slots": ["08:00-08:30", "08:30-09:00", "10:30-11:00", "11:30-12:00"],
@@ -45,13 +113,49 @@ def create_sample_doctors():
         }
     ]
     
-    # Check if doctors already exist
-    if doctors_collection.count_documents({}) == 0:
-        doctors_collection.insert_many(sample_doctors)
-        print("Sample doctors created successfully!")
+    # Insert any missing doctors in one unordered, idempotent batch
+    try:
+        result = await doctors_collection.bulk_write(
+            [
+                UpdateOne(
+                    # Also adopt doctors seeded before seed_key existed
+                    {"$or": [
+                        {"seed_key": doctor["seed_key"]},
+                        {"name": doctor["name"], "seed_key": {"$exists": False}}
+                    ]},
+                    {
+                        "$set": {"seed_key": doctor["seed_key"]},
+                        "$setOnInsert": {k: v for k, v in doctor.items() if k != "seed_key"}
+                    },
+                    upsert=True
+                )
+                for doctor in sample_doctors
+            ],
+            ordered=False
+        )
+        upserted_count = result.upserted_count
+    except BulkWriteError as exc:
+        # Another worker inserted the same doctor concurrently; the unique
+        # seed_key index rejected our copy, which is fine
+        write_errors = exc.details.get("writeErrors", [])
+        if (
+            not write_errors
+            or exc.details.get("writeConcernErrors")
+            or any(error["code"] != 11000 for error in write_errors)
+        ):
+            raise
+        upserted_count = exc.details["nUpserted"]
+    
+    if upserted_count:
+        invalidate_doctor_cache()
+        print(f"{upserted_count} sample doctors created successfully!")
     else:
         print("Doctors already exist in database")
 
 # Initialize database with sample data
 if __name__ == "__main__":
-    create_sample_doctors()
\ No newline at end of file
+    async def init_db():
+        await ensure_indexes()
+        await create_sample_doctors()
+
+    asyncio.run(init_db())
\ No newline at end of file
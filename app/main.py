@@ -1,8 +1,9 @@
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import ORJSONResponse
 from app.auth import router as auth_router
 from app.appointments import router as appointments_router
-from app.database import create_sample_doctors
+from app.database import create_sample_doctors, ensure_indexes
 
 # Create FastAPI application
 app = FastAPI(
@@ -10,7 +11,8 @@ app = FastAPI(
     description="A comprehensive system for managing doctor appointments with user authentication",
     version="1.0.0",
     docs_url="/docs",
-    redoc_url="/redoc"
+    redoc_url="/redoc",
+    default_response_class=ORJSONResponse
 )
 
 # Add CORS middleware
@@ -28,8 +30,9 @@ app.include_router(appointments_router)
 
 @app.on_event("startup")
 async def startup_event():
-    """Initialize database with sample data on startup"""
-    create_sample_doctors()
+    """Initialize database indexes and sample data on startup"""
+    await ensure_indexes()
+    await create_sample_doctors()
 
 @app.get("/")
 async def root():